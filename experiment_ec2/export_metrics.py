@@ -2,7 +2,8 @@
 """
 Export Sock Shop service + node metrics into a single, wide CSV for RCA.
 
-(UNCHANGED CLI / behavior)
+(CLI / behavior unchanged, plus opt-in --metricsql for VictoriaMetrics backends
+ and opt-in --float32 for lower memory at float32 precision)
 - Pulls container CPU/Mem/Net (cAdvisor/Kubelet)
 - Pulls Istio request/error and latency percentiles (from histograms)
 - Pulls a small, curated set of node metrics (help causal structure; not eval labels)
@@ -19,15 +20,38 @@ ADJUSTED IN THIS VERSION (per our agreement):
 
 import argparse
 import datetime as dt
-import math
 import sys
-from typing import Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # C JSON decoder; optional, falls back to requests' stdlib json
+except ImportError:
+    orjson = None
 
 rate_window = "2m"
 
+# Bounded fan-out for range queries: they are I/O-bound, but we don't want to
+# hammer Prometheus/VM with one connection per query.
+MAX_WORKERS = 8
+_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+# One pooled keep-alive session shared by all workers (no handshake per query)
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=16, pool_maxsize=16,
+                       max_retries=Retry(total=2, backoff_factor=0.2))
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
+
+# Synthetic label used to tag each sub-query when several are sent as one `or` query
+BATCH_LABEL = "export_col"
+
 def _parse_args():
     ap = argparse.ArgumentParser()
     ap.add_argument("--prom", default="http://127.0.0.1:8428",
@@ -59,15 +83,24 @@ def _parse_args():
                     help="Verify TLS certs to Prometheus")
     ap.add_argument("--lat-histogram", choices=["ms", "s"], default="ms",
                     help="Istio duration unit in histogram name: 'ms' or 's'")
+    ap.add_argument("--float32", action="store_true",
+                    help="Parse metric values as float32: halves memory for long windows, "
+                         "but CSV values carry only ~7 significant digits")
+    ap.add_argument("--metricsql", action="store_true",
+                    help="Backend is VictoriaMetrics: get latency-50/90 from one MetricsQL "
+                         "histogram_quantiles() call so the bucket rate-sum is evaluated once")
     ap.add_argument("--bytes-histogram", choices=["response", "request"], default="response",
                     help="Unused here (kept for compatibility)")
     return ap.parse_args()
 
+def _json(r: requests.Response) -> dict:
+    return orjson.loads(r.content) if orjson is not None else r.json()
+
 def prom_instant(prom: str, q: str, timeout: int, verify: bool) -> dict:
     url = f"{prom.rstrip('/')}/api/v1/query"
     params = {"query": q}
-    r = requests.get(url, params=params, timeout=timeout, verify=verify)
-    data = r.json()
+    r = _SESSION.get(url, params=params, timeout=timeout, verify=verify)
+    data = _json(r)
     if r.status_code != 200 or data.get("status") != "success":
         err = data.get("error") or data
         raise RuntimeError(f"Prometheus instant error:\nQuery:\n{q}\n\nError:\n{err}")
@@ -115,51 +148,91 @@ def _compute_window(args):
 def prom_range(prom: str, q: str, start: str, end: str, step: str, timeout: int, verify: bool) -> Dict:
     url = f"{prom.rstrip('/')}/api/v1/query_range"
     params = {"query": q, "start": start, "end": end, "step": step}
-    r = requests.get(url, params=params, timeout=timeout, verify=verify)
+    r = _SESSION.get(url, params=params, timeout=timeout, verify=verify)
     r.raise_for_status()
-    data = r.json()
+    data = _json(r)
     if data.get("status") != "success":
         raise RuntimeError(f"Prometheus error for {q}: {data}")
     return data
 
-def _ts_matrix_to_series(payload: Dict, target_col: str) -> pd.DataFrame:
+def prom_range_many(prom: str, jobs: List[Tuple[str, str]], start: str, end: str, step: str,
+                    timeout: int, verify: bool) -> List[Tuple[str, Dict]]:
+    """Run (col, query) jobs concurrently; returns (col, payload) in job order."""
+    payloads = _EXECUTOR.map(
+        lambda job: prom_range(prom, job[1], start, end, step, timeout, verify), jobs
+    )
+    return [(col, payload) for (col, _), payload in zip(jobs, payloads)]
+
+# A job is (col, query), or (cols_tuple, query) when the query sets BATCH_LABEL on its own series
+Job = Tuple[Union[str, Tuple[str, ...]], str]
+
+def _job_cols(col: Union[str, Tuple[str, ...]]) -> Tuple[str, ...]:
+    return col if isinstance(col, tuple) else (col,)
+
+def _batch_query(jobs: List[Job]) -> str:
+    # label_replace keeps each sub-query's series distinct so `or` drops nothing
+    return "\nor\n".join(
+        q if isinstance(col, tuple) else f'label_replace({q}, "{BATCH_LABEL}", "{col}", "", "")'
+        for col, q in jobs
+    )
+
+def _split_batch(payload: Dict, cols: Tuple[str, ...]) -> List[Tuple[str, Dict]]:
+    by_col: Dict[str, list] = {col: [] for col in cols}
+    for series in payload["data"]["result"]:
+        col = series.get("metric", {}).get(BATCH_LABEL)
+        if col in by_col:
+            by_col[col].append(series)
+    return [(col, {"data": {"result": res}}) for col, res in by_col.items()]
+
+def prom_range_batched(prom: str, batches: List[List[Job]], start: str, end: str, step: str,
+                       timeout: int, verify: bool) -> List[Tuple[str, Dict]]:
+    """One HTTP call per batch of (col, query) jobs; payloads are split back out per col."""
+    jobs = [(tuple(c for col, _ in b for c in _job_cols(col)), _batch_query(b)) for b in batches if b]
+    out = []
+    for cols, payload in prom_range_many(prom, jobs, start, end, step, timeout, verify):
+        out.extend(_split_batch(payload, cols))
+    return out
+
+def _build_series(series: Dict, target_col: str, dtype=np.float64) -> pd.Series:
+    arr = np.asarray(series["values"], dtype=object)
+    # Keep time as epoch seconds INT (no datetime conversion)
+    ts = arr[:, 0].astype(np.float64).astype(np.int64)
+    # be robust to weird strings: NaN/None/garbage coerce to NaN; the literal "Inf"/"-Inf"
+    # strings are NaN too, but "+Inf" (histogram_quantile in the top bucket) stays inf
+    raw = arr[:, 1]
+    v = pd.to_numeric(raw, errors="coerce").astype(dtype)
+    v[np.isin(raw, ("Inf", "-Inf"))] = np.nan
+    # int64 "time" index up front so later concat/joins stay on the integer fast path
+    return pd.Series(v, index=pd.Index(ts, dtype=np.int64, name="time"), name=target_col)
+
+def _ts_matrix_to_series(payload: Dict, target_col: str, dtype=np.float64) -> pd.Series:
     res = payload["data"]["result"]
-    if not res:
-        return pd.DataFrame(columns=["time", target_col]).set_index("time")
-
-    frames = []
-    for series in res:
-        vals = series.get("values") or []
-        if not vals:
-            continue
-
-        # Keep time as epoch seconds INT (no datetime conversion)
-        ts = [int(float(t)) for t, _ in vals]
-        v = []
-        for _, x in vals:
-            # be robust to weird strings
-            if x in ("NaN", "Inf", "-Inf", None):
-                v.append(math.nan)
-            else:
-                try:
-                    v.append(float(x))
-                except Exception:
-                    v.append(math.nan)
-
-        frames.append(pd.DataFrame({"time": ts, target_col: v}).set_index("time"))
-
-    if not frames:
-        return pd.DataFrame(columns=["time", target_col]).set_index("time")
+    series = [_build_series(s, target_col, dtype) for s in res if s.get("values")]
+    if not series:
+        return pd.Series(dtype=dtype, index=pd.Index([], dtype=np.int64, name="time"), name=target_col)
+
+    if len(series) == 1:
+        # Already aggregated in PromQL (e.g. sum(...)); nothing to fold
+        return series[0]
+
+    idx = series[0].index
+    if idx.is_unique and all(s.index.equals(idx) for s in series[1:]):
+        # Pods normally share the query's step grid: sum the stacked values in one NumPy pass
+        stacked = np.vstack([s.to_numpy() for s in series])
+        summed = np.nansum(stacked, axis=0)
+        summed[np.isnan(stacked).all(axis=0)] = np.nan  # same as sum(min_count=1)
+        return pd.Series(summed, index=idx, name=target_col)
 
     # Sum across returned series (pods) at the SAME epoch second
-    df = pd.concat(frames, axis=0).groupby(level=0).sum(min_count=1)
-    df.index.name = "time"
-    return df
+    out = pd.concat(series, axis=0).groupby(level=0, sort=False).sum(min_count=1)
+    out.index.name = "time"
+    return out
+
+CSV_CHUNK_ROWS = 10_000
 
-def _merge_into(base: Optional[pd.DataFrame], newdf: pd.DataFrame) -> pd.DataFrame:
-    if base is None:
-        return newdf
-    return base.join(newdf, how="outer")
+def _write_csv(df: pd.DataFrame, path: str) -> None:
+    # Written in CSV_CHUNK_ROWS slices so long windows / small steps don't buffer the whole file
+    df.to_csv(path, index=False, chunksize=CSV_CHUNK_ROWS)
 
 # -----------------------------
 # PromQL builders (adjusted)
@@ -181,16 +254,29 @@ sum by (pod) (
 )
 '''.strip()
 
-def _istio_latency_quantile_service(namespace: str, svc: str, qtile: float, unit: str) -> str:
+LATENCY_QUANTILES = [(0.50, "latency-50"), (0.90, "latency-90")]
+
+def _istio_latency_buckets_service(namespace: str, svc: str, unit: str) -> str:
     metric = "istio_request_duration_milliseconds_bucket" if unit == "ms" else "istio_request_duration_seconds_bucket"
     # destination_service_name label (as per your VM)
     return f'''
-histogram_quantile({qtile},
   sum by (le) (
     rate({metric}{{reporter="source", destination_service_name="{svc}", destination_service_namespace="{namespace}"}}[{rate_window}])
   )
-)
-'''.strip()
+'''.strip("\n")
+
+def _istio_latency_quantile_service(namespace: str, svc: str, qtile: float, unit: str) -> str:
+    return f"histogram_quantile({qtile},\n{_istio_latency_buckets_service(namespace, svc, unit)}\n)"
+
+def q_istio_latency_quantiles_metricsql(namespace: str, svc: str, unit: str) -> str:
+    # MetricsQL only: all quantiles from one bucket evaluation, one series per phi.
+    # Each exact phi value is mapped to its own BATCH_LABEL column, one label_replace per quantile.
+    phis = ", ".join(str(qtile) for qtile, _ in LATENCY_QUANTILES)
+    q = f'histogram_quantiles("phi", {phis},\n{_istio_latency_buckets_service(namespace, svc, unit)}\n)'
+    for qtile, suffix in LATENCY_QUANTILES:
+        phi_re = str(qtile).replace(".", "[.]")
+        q = f'label_replace(\n{q},\n"{BATCH_LABEL}", "{svc}_{suffix}", "phi", "{phi_re}")'
+    return q
 
 def q_istio_requests_service(namespace: str, svc: str) -> str:
     return f'''
@@ -236,26 +322,13 @@ def q_node_net_rx_err(instance: str, rate_window: str) -> str:
 def q_node_net_tx_err(instance: str, rate_window: str) -> str:
     return f'sum by (instance) (rate(node_network_transmit_errs_total{{instance="{instance}", device!="lo"}}[{rate_window}]))'
 
-def collect_for_node(prom, instance, start, end, step, timeout, verify, rate_window) -> pd.DataFrame:
-    df_all = None
-
-    col = f"node_{instance}_cpu-usage"
-    payload = prom_range(prom, q_node_cpu_usage(instance, rate_window), start, end, step, timeout, verify)
-    df_all = _merge_into(df_all, _ts_matrix_to_series(payload, col))
-
-    col = f"node_{instance}_mem-available-bytes"
-    payload = prom_range(prom, q_node_mem_available(instance), start, end, step, timeout, verify)
-    df_all = _merge_into(df_all, _ts_matrix_to_series(payload, col))
-
-    col = f"node_{instance}_net-rx-errors"
-    payload = prom_range(prom, q_node_net_rx_err(instance, rate_window), start, end, step, timeout, verify)
-    df_all = _merge_into(df_all, _ts_matrix_to_series(payload, col))
-
-    col = f"node_{instance}_net-tx-errors"
-    payload = prom_range(prom, q_node_net_tx_err(instance, rate_window), start, end, step, timeout, verify)
-    df_all = _merge_into(df_all, _ts_matrix_to_series(payload, col))
-
-    return df_all
+def collect_for_node(instance, rate_window) -> List[Tuple[str, str]]:
+    return [
+        (f"node_{instance}_cpu-usage", q_node_cpu_usage(instance, rate_window)),
+        (f"node_{instance}_mem-available-bytes", q_node_mem_available(instance)),
+        (f"node_{instance}_net-rx-errors", q_node_net_rx_err(instance, rate_window)),
+        (f"node_{instance}_net-tx-errors", q_node_net_tx_err(instance, rate_window)),
+    ]
 
 # -----------------------------
 # SIMPLE schema (exact order)
@@ -288,39 +361,23 @@ WORKLOAD_SERVICES = {"carts","catalogue","front-end","orders","payment","queue-m
 ERROR_SERVICES    = {"carts","front-end","orders","queue-master","shipping"}
 LAT_SERVICES      = {"carts","catalogue","front-end","orders","payment","shipping","user"}
 
-def collect_for_service_simple(prom, ns, svc, start, end, step, timeout, verify, lat_unit) -> pd.DataFrame:
-    df_all = None
+def collect_for_service_simple(ns, svc, lat_unit, metricsql=False) -> List[Job]:
+    jobs = []
 
     # CPU
-    cpu_col = f"{svc}_cpu"
-    print("cpu", svc, "=>", end)
-    payload = prom_range(prom, q_container_cpu_usage(ns, svc), start, end, step, timeout, verify)
-    df_all = _merge_into(df_all, _ts_matrix_to_series(payload, cpu_col))
+    jobs.append((f"{svc}_cpu", q_container_cpu_usage(ns, svc)))
 
     # MEM
-    mem_col = f"{svc}_mem"
-    print("mem", svc, "=>", end)
-    payload = prom_range(prom, q_mem_usage(ns, svc), start, end, step, timeout, verify)
- #   res = payload["data"]["result"]
-    # print("series_count =", len(res))
-    # for s in res:
-    #     pod = s.get("metric", {}).get("pod", "<no pod>")
-    #     vals = s.get("values") or []
-    #     last = int(float(vals[-1][0])) if vals else None
-    #     print("pod =", pod, "last_ts =", last)
-    #print(svc, "mem payload series=", len(payload["data"]["result"]),"last payload ts=", int(float(payload["data"]["result"][0]["values"][-1][0])))
-    df_all = _merge_into(df_all, _ts_matrix_to_series(payload, mem_col))
+    jobs.append((f"{svc}_mem", q_mem_usage(ns, svc)))
 
     # WORKLOAD
     if svc in WORKLOAD_SERVICES:
         w_col = f"{svc}_workload"
         if svc == "queue-master":
             # TCP workload (bytes/sec) in your setup
-            payload = prom_range(prom, q_queue_master_tcp_workload(ns), start, end, step, timeout, verify)
-            df_all = _merge_into(df_all, _ts_matrix_to_series(payload, w_col))
+            jobs.append((w_col, q_queue_master_tcp_workload(ns)))
         else:
-            payload = prom_range(prom, q_istio_requests_service(ns, svc), start, end, step, timeout, verify)
-            df_all = _merge_into(df_all, _ts_matrix_to_series(payload, w_col))
+            jobs.append((w_col, q_istio_requests_service(ns, svc)))
 
     # ERROR
     if svc in ERROR_SERVICES:
@@ -329,38 +386,42 @@ def collect_for_service_simple(prom, ns, svc, start, end, step, timeout, verify,
             # No HTTP errors expected for queue-master (TCP traffic). Keep column as NaN (schema will include it).
             pass
         else:
-            payload = prom_range(prom, q_istio_errors_service(ns, svc), start, end, step, timeout, verify)
-            df_all = _merge_into(df_all, _ts_matrix_to_series(payload, e_col))
+            jobs.append((e_col, q_istio_errors_service(ns, svc)))
 
     # LATENCY
     if svc in LAT_SERVICES:
         if svc == "queue-master":
             # Not derivable from standard Istio TCP telemetry; leave as NaN.
             pass
+        elif metricsql:
+            l_cols = tuple(f"{svc}_{suffix}" for _, suffix in LATENCY_QUANTILES)
+            jobs.append((l_cols, q_istio_latency_quantiles_metricsql(ns, svc, lat_unit)))
         else:
-            for qtile, suffix in [(0.50, "latency-50"), (0.90, "latency-90")]:
+            for qtile, suffix in LATENCY_QUANTILES:
                 l_col = f"{svc}_{suffix}"
-                q = _istio_latency_quantile_service(ns, svc, qtile, lat_unit)
-                payload = prom_range(prom, q, start, end, step, timeout, verify)
-                df_all = _merge_into(df_all, _ts_matrix_to_series(payload, l_col))
+                jobs.append((l_col, _istio_latency_quantile_service(ns, svc, qtile, lat_unit)))
 
-    return df_all
+    return jobs
 
 def main():
     args = _parse_args()
     start, end = _compute_window(args)
     services = [s.strip() for s in args.services.split(",") if s.strip()]
 
-    merged: Optional[pd.DataFrame] = None
+    value_dtype = np.float32 if args.float32 else np.float64
 
-    # Services (simple output)
+    # col -> series; joined once at the end instead of one outer join per column
+    all_series: Dict[str, pd.Series] = {}
+
+    # Services (simple output): one batched query per service, all submitted up front
+    batches = []
     for svc in services:
-        svc_df = collect_for_service_simple(
-            args.prom, args.namespace, svc, start, end, args.step,
-            args.timeout, args.verify_tls, args.lat_histogram
-        )
-        if svc_df is not None:
-            merged = _merge_into(merged, svc_df)
+        print("queries", svc, "=>", end)
+        batches.append(collect_for_service_simple(args.namespace, svc, args.lat_histogram,
+                                                  args.metricsql))
+    for col, payload in prom_range_batched(args.prom, batches, start, end, args.step,
+                                           args.timeout, args.verify_tls):
+        all_series[col] = _ts_matrix_to_series(payload, col, value_dtype)
 
     # Nodes (optional) - still collected to keep functionality, but omitted from final CSV
     if args.nodes:
@@ -370,12 +431,15 @@ def main():
         if not worker_instances:
             print("Warning: no worker instances discovered (check node_exporter/node_uname_info).", file=sys.stderr)
         else:
-            for inst in worker_instances:
-                node_df = collect_for_node(
-                    args.prom, inst, start, end, args.step, args.timeout, args.verify_tls, rate_window
-                )
-                if node_df is not None:
-                    merged = _merge_into(merged, node_df)
+            # one batched query per node, all nodes fanned out together
+            node_batches = [collect_for_node(inst, rate_window) for inst in worker_instances]
+            for col, payload in prom_range_batched(args.prom, node_batches, start, end, args.step,
+                                                   args.timeout, args.verify_tls):
+                all_series[col] = _ts_matrix_to_series(payload, col, value_dtype)
+
+    merged = pd.concat(all_series, axis=1).sort_index() if all_series else None
+    if merged is not None:
+        merged.index.name = "time"
 
     if merged is None or merged.empty:
         print("No data returned. Check labels, metric names, or time range.", file=sys.stderr)
@@ -392,16 +456,9 @@ def main():
     #merged.index.name = "time"
 
     # Force output schema to match simple_data.csv exactly
-    out_df = merged.copy()
-    for col in SIMPLE_COLS_ORDER:
-        if col == "time":
-            continue
-        if col not in out_df.columns:
-            out_df[col] = math.nan
-
-    out_df = out_df.reset_index()
-    out_df = out_df[SIMPLE_COLS_ORDER]
-    out_df.to_csv(args.out, index=False)
+    # (missing columns come back as NaN from a single reindex)
+    out_df = merged.reset_index().rename(columns={"index": "time"}).reindex(columns=SIMPLE_COLS_ORDER)
+    _write_csv(out_df, args.out)
     print(f"Wrote {args.out} with shape {out_df.shape}")
 
 if __name__ == "__main__":
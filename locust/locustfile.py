@@ -1,9 +1,14 @@
 from locust import HttpUser, task, between
 import random
 import re
+import threading
 import uuid
 import base64
 
+# UUID-like product ids (e.g. 03fef6ac-1896-4ce8-bd69-b798f85c6e0b), compiled once per process
+_UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.I)
+_choice = random.choice  # bound once; called on every view_item/add_to_cart
+
 class SockShopUser(HttpUser):
     wait_time = between(1, 3)
 
@@ -22,19 +27,16 @@ class SockShopUser(HttpUser):
     REGISTER_PATH = "/register"   # often POST
     CHECKOUT_PATH = "/orders"     # sometimes POST /orders, or /checkout, etc.
 
-    item_ids = []
+    # Catalogue ids are static: fetched by the first user, shared by the rest
+    _ITEM_IDS = None
+    _ITEM_IDS_LOCK = threading.Lock()
 
     def on_start(self):
         # 1) Establish session cookie
         self.client.get("/")
 
         # 2) Collect product IDs from catalogue (your original logic)
-        r = self.client.get("/catalogue")
-        self.item_ids = re.findall(
-            r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}",
-            r.text,
-            re.I
-        )
+        self.item_ids = self._load_item_ids()
         if not self.item_ids:
             self.item_ids = ["03fef6ac-1896-4ce8-bd69-b798f85c6e0b"]
 
@@ -47,6 +49,19 @@ class SockShopUser(HttpUser):
             self._ensure_logged_in()
 
     # ---------------- Helpers ----------------
+    def _load_item_ids(self):
+        """Fetch /catalogue ids once per process; later users reuse the cached list."""
+        cls = SockShopUser
+        if cls._ITEM_IDS is None:
+            with cls._ITEM_IDS_LOCK:
+                if cls._ITEM_IDS is None:
+                    r = self.client.get("/catalogue")
+                    ids = _UUID_RE.findall(r.text)
+                    if ids:  # don't cache an empty scrape; let the next user retry
+                        cls._ITEM_IDS = ids
+                    return ids
+        return cls._ITEM_IDS
+
     def _ensure_logged_in(self):
         """Try register then login. Mark logged_in=True only if response indicates success."""
         if self.logged_in:
@@ -116,7 +131,7 @@ class SockShopUser(HttpUser):
 
     @task(2)
     def view_item(self):
-        pid = random.choice(self.item_ids)
+        pid = _choice(self.item_ids)
         self.client.get(f"/detail.html?id={pid}")
 
     @task(1)
@@ -126,7 +141,7 @@ class SockShopUser(HttpUser):
     @task(W_CART)
     def add_to_cart(self):
         # Keep your original behavior since it works in your environment.
-        pid = random.choice(self.item_ids)
+        pid = _choice(self.item_ids)
         self.client.get("/cart", json={"id": pid, "quantity": 1})
 
     # ---------------- New optional tasks ----------------
@@ -1,22 +1,39 @@
 from locust import HttpUser, task, between
 import random
 import re
+import threading
+
+# UUID-like product ids (e.g. 03fef6ac-1896-4ce8-bd69-b798f85c6e0b), compiled once per process
+_UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.I)
+_choice = random.choice  # bound once; called on every view_item/add_to_cart
 
 class SockShopUser(HttpUser):
     wait_time = between(1, 3)  # 1–3s think time
-    item_ids = []
+    # Catalogue ids are static: fetched by the first user, shared by the rest
+    _ITEM_IDS = None
+    _ITEM_IDS_LOCK = threading.Lock()
 
     def on_start(self):
         # Prime a session and try to collect item IDs from /catalogue for /detail and add-to-cart
         self.client.get("/")  # establish session cookie
-        r = self.client.get("/catalogue")
-        # Very simple ID scrape (catalogue JSON or HTML with IDs)
-        # Matches UUID-like ids seen in Sock Shop (e.g., 03fef6ac-1896-4ce8-bd69-b798f85c6e0b)
-        self.item_ids = re.findall(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", r.text, re.I)
+        self.item_ids = self._load_item_ids()
         if not self.item_ids:
             # fallback to a known valid demo id
             self.item_ids = ["03fef6ac-1896-4ce8-bd69-b798f85c6e0b"]
 
+    def _load_item_ids(self):
+        # Very simple ID scrape (catalogue JSON or HTML with IDs), done once per process
+        cls = SockShopUser
+        if cls._ITEM_IDS is None:
+            with cls._ITEM_IDS_LOCK:
+                if cls._ITEM_IDS is None:
+                    r = self.client.get("/catalogue")
+                    ids = _UUID_RE.findall(r.text)
+                    if ids:  # don't cache an empty scrape; let the next user retry
+                        cls._ITEM_IDS = ids
+                    return ids
+        return cls._ITEM_IDS
+
     @task(3)
     def home(self):
         self.client.get("/")
@@ -28,7 +45,7 @@ class SockShopUser(HttpUser):
 
     @task(1)
     def view_item(self):
-        pid = random.choice(self.item_ids)
+        pid = _choice(self.item_ids)
         self.client.get(f"/detail.html?id={pid}")
 
     @task(1)
@@ -40,5 +57,5 @@ class SockShopUser(HttpUser):
     def add_to_cart(self):
         # API call via front-end → carts service.
         # Sock Shop accepts {"id": "<productId>", "quantity": 1}
-        pid = random.choice(self.item_ids)
+        pid = _choice(self.item_ids)
         self.client.get("/cart", json={"id": pid, "quantity": 1})
\ No newline at end of file